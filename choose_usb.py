@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# ============================================================================
+# DASHCAM - MODE LÉGER (ffmpeg géré directement par systemd)
+# ============================================================================
+# Ce script choisit la clé USB puis SE REMPLACE par ffmpeg : Python ne reste
+# en mémoire que le temps du choix (quelques dizaines de millisecondes)
+# C'est systemd qui relance ffmpeg s'il s'arrête (clé pleine ou retirée...),
+# en repassant par ce script pour choisir de nouveau la clé
+# Voir dashcam-lite.service
+# ============================================================================
+
+# ---------- IMPORTS (bibliothèques nécessaires) ----------
+import logging     # Pour afficher les messages horodatés
+import os          # Pour remplacer ce script par ffmpeg
+import sys         # Pour la sortie standard (messages) et le code de retour
+
+# Même choix de clé et même commande ffmpeg que recorder.py
+from recorder import (FFMPEG_CMD, log, raise_priority, select_usb_path,
+                      set_current_usb)
+
+
+# ============================================================================
+# FONCTION PRINCIPALE : main
+# ============================================================================
+def main():
+    # Pas de thread d'affichage ici : le script ne vit que quelques instants
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format="[%(asctime)s] %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    
+    # ---------- ÉTAPE 1 : Sélectionner la clé USB à utiliser ----------
+    usb_path = select_usb_path()
+    
+    # Aucune clé : code d'erreur, systemd réessaiera après RestartSec
+    if not usb_path:
+        sys.exit(1)
+    
+    # ---------- ÉTAPE 2 : Faire pointer le lien vers la clé choisie ----------
+    set_current_usb(usb_path)
+    log.info("Début enregistrement continu (vidéo seule) sur %s", usb_path)
+    
+    # ---------- ÉTAPE 3 : Se remplacer par ffmpeg ----------
+    # Cœurs, priorité temps réel et ioprio sont conservés par exec : réglés
+    # ici, ils s'appliquent à ffmpeg et à tous les threads qu'il créera
+    raise_priority(os.getpid())
+    
+    # Les messages doivent être écrits avant : exec ne revient jamais
+    sys.stdout.flush()
+    os.execvp(FFMPEG_CMD[0], FFMPEG_CMD)
+
+
+# ============================================================================
+# POINT D'ENTRÉE DU PROGRAMME
+# ============================================================================
+if __name__ == "__main__":
+    main()
@@ -42,7 +42,9 @@ fi
 
 # Compter le nombre TOTAL de vidéos sur toutes les clés montées
 # Cette commande combine les résultats de find sur toutes les clés
-TOTAL_VIDEOS=$(find "${MOUNTED_PATHS[@]}" -maxdepth 1 -name "video_*.avi" 2>/dev/null | wc -l)
+# (vidéos .mp4, et anciennes vidéos .avi enregistrées par les versions
+# précédentes du script)
+TOTAL_VIDEOS=$(find "${MOUNTED_PATHS[@]}" -maxdepth 1 \( -name "video_*.mp4" -o -name "video_*.avi" \) 2>/dev/null | wc -l)
 
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] Total de vidéos sur toutes les clés: $TOTAL_VIDEOS"
 
@@ -65,12 +67,12 @@ echo "[$(date '+%Y-%m-%d %H:%M:%S')] Suppression de $TO_DELETE anciennes vidéos
 
 # Cette commande complexe fonctionne ainsi :
 #
-# 1. find "${MOUNTED_PATHS[@]}" -maxdepth 1 -name "video_*.avi" -type f -printf '%T+ %p\n' 2>/dev/null
+# 1. find "${MOUNTED_PATHS[@]}" -maxdepth 1 \( -name "video_*.mp4" -o -name "video_*.avi" \) -type f -printf '%T+ %p\n' 2>/dev/null
 #    Cherche TOUTES les vidéos sur TOUTES les clés montées
 #    Affiche pour chaque fichier : date_de_modification chemin_complet
 #    Exemple :
 #    2025-10-03+14:35:20 /mnt/usb1/video_20251003_143520.avi
-#    2025-10-03+14:40:25 /mnt/usb2/video_20251003_144025.avi
+#    2025-10-03+14:40:25 /mnt/usb2/video_20251003_144025.mp4
 #    2025-10-04+09:15:10 /mnt/usb1/video_20251004_091510.avi
 #
 # 2. sort
@@ -86,7 +88,7 @@ echo "[$(date '+%Y-%m-%d %H:%M:%S')] Suppression de $TO_DELETE anciennes vidéos
 # 5. while read file; do ... done
 #    Pour chaque fichier à supprimer :
 
-find "${MOUNTED_PATHS[@]}" -maxdepth 1 -name "video_*.avi" -type f -printf '%T+ %p\n' 2>/dev/null | \
+find "${MOUNTED_PATHS[@]}" -maxdepth 1 \( -name "video_*.mp4" -o -name "video_*.avi" \) -type f -printf '%T+ %p\n' 2>/dev/null | \
 sort | head -n "$TO_DELETE" | cut -d' ' -f2- | \
 while read file; do
     # Supprimer le fichier (peu importe sur quelle clé il se trouve)
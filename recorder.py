@@ -2,15 +2,26 @@
 # ============================================================================
 # DASHCAM AUTOMATIQUE POUR RASPBERRY PI 3 (VIDÉO SEULE)
 # ============================================================================
-# Ce script enregistre automatiquement des vidéos de 5 minutes en boucle
+# Ce script enregistre automatiquement des vidéos de 5 minutes en continu
 # sur deux clés USB, en basculant sur la deuxième quand la première est pleine
 # ============================================================================
 
 # ---------- IMPORTS (bibliothèques nécessaires) ----------
+import array       # Tableau compact des espaces libres (voir select_usb_path)
+import atexit      # Pour terminer proprement l'affichage des messages
 import subprocess  # Pour exécuter des commandes système (ffmpeg)
+import ctypes      # Pour appeler directement des fonctions système (libc)
+import errno       # Codes d'erreur des fonctions système
+import logging     # Pour afficher les messages horodatés
+import logging.handlers  # Pour écrire les messages dans un thread séparé
 import os          # Pour gérer les fichiers et dossiers
-import time        # Pour faire des pauses entre les enregistrements
-from datetime import datetime  # Pour obtenir la date et l'heure actuelles
+import queue       # File d'attente des messages à afficher
+import select      # Pour attendre le branchement d'une clé sans scruter
+import shutil      # Pour garder une copie du journal de ffmpeg
+import signal      # Pour demander à ffmpeg de s'arrêter proprement
+import sys         # Pour la sortie standard (messages)
+import threading   # Threads de travail et verrou sur les données partagées
+import time        # Pour faire des pauses entre les vérifications
 
 # ---------- CONFIGURATION GLOBALE ----------
 # Ces paramètres définissent comment la dashcam fonctionne
@@ -28,42 +39,398 @@ VIDEO_HEIGHT = 720   # Hauteur : 720 pixels
 # Périphérique de la webcam USB détecté par le système
 DEVICE = "/dev/video0"
 
-# Temps d'attente entre deux enregistrements (en secondes)
-# 1 seconde permet au système de respirer entre deux vidéos
-INTERVAL = 1
+# Cœurs utilisables par ce script et par ffmpeg
+AVAILABLE_CPUS = os.sched_getaffinity(0)
+
+# Répartition des cœurs : le cœur 0 traite les interruptions USB (webcam et
+# clés) sur le Raspberry Pi, ni ffmpeg ni ce script n'y sont placés
+# - FFMPEG_CPUS : cœurs de ffmpeg, en temps réel (voir set_thread_priority)
+# - SUPERVISOR_CPUS : cœur de ce script (et de ses threads), qui doit rester
+#   HORS de FFMPEG_CPUS : les threads temps réel de ffmpeg passeraient
+#   toujours avant lui, et il ne pourrait plus arrêter un ffmpeg emballé
+if len(AVAILABLE_CPUS) >= 3:
+    # Pi 3 ou 4 : ffmpeg sur les cœurs 1 et 2, ce script sur le cœur 3
+    SUPERVISOR_CPUS = {max(AVAILABLE_CPUS)}
+    FFMPEG_CPUS = AVAILABLE_CPUS - {0} - SUPERVISOR_CPUS
+else:
+    # Un ou deux cœurs : pas de cœur à part pour ce script (None = pas
+    # d'épinglage), ffmpeg hors du cœur 0 s'il y en a un autre
+    SUPERVISOR_CPUS = None
+    FFMPEG_CPUS = (AVAILABLE_CPUS - {0}) or {0}
+
+# Nombre de threads de traitement de ffmpeg : un par cœur de FFMPEG_CPUS (des
+# threads temps réel en surnombre sur un même cœur attendraient leur tour)
+FFMPEG_THREADS = len(FFMPEG_CPUS)
+
+# Priorité temps réel de ffmpeg (SCHED_FIFO, de 1 à 99) : au-dessus de toutes
+# les tâches normales, mais loin sous les threads temps réel du noyau (50)
+# Elle s'applique aussi au décodage MJPEG fait par le processeur : voir
+# set_thread_priority
+FFMPEG_RT_PRIORITY = 10
+
+# Taille de la file d'attente de lecture de la webcam (en images) : absorbe
+# les à-coups entre la capture et le traitement
+INPUT_QUEUE_SIZE = 512
+
+# Taille de la file d'attente d'écriture de ffmpeg (en images)
+# 600 images = environ 20 secondes de vidéo à 30 images/s gardées en mémoire
+# pendant que la clé USB est occupée (ses pauses internes durent souvent
+# plusieurs centaines de millisecondes)
+WRITE_QUEUE_SIZE = 600
+
+# Débit vidéo de l'encodeur matériel H.264 du Raspberry Pi (en bits/s)
+# 4 Mbit/s en 720p = environ 150 Mo par segment de 5 minutes
+# (contre 1 à 2 Go en MJPEG brut)
+H264_BITRATE = 4_000_000
+
+# Débit mesuré du flux MJPEG brut de la webcam en 1280x720 (en bits/s)
+# Utilisé pour estimer la taille d'un segment quand on copie le MJPEG
+MJPEG_BITRATE = 30_000_000
+
+# Intervalle entre deux vérifications des clés USB pendant l'enregistrement
+# (en secondes). ffmpeg tourne en continu, on vérifie juste s'il faut basculer
+# (vérification peu coûteuse grâce au cache de l'espace libre, voir plus bas)
+CHECK_INTERVAL = 10
+
+# Durée pendant laquelle l'espace libre mesuré sur une clé reste valable
+# (en secondes) avant d'être recalculé
+FREE_SPACE_CACHE_TTL = 60
+
+# Intervalle entre deux coups d'œil sur ffmpeg et sur le segment en cours
+# (en secondes)
+POLL_INTERVAL = 1
+
+# Intervalle entre deux envois vers la clé de ce que ffmpeg a écrit
+# (en secondes, voir drip_sync)
+DRIP_INTERVAL = 2
 
 # Espace minimum requis sur une clé avant de basculer sur l'autre (en Go)
 MIN_FREE_SPACE_GB = 2
 
+# Espace en dessous duquel ffmpeg est arrêté immédiatement, sans attendre la
+# fin du segment (en Go) : mieux vaut un segment court qu'un fichier illisible
+EMERGENCY_FREE_SPACE_GB = 0.2
+
+# Temps laissé à ffmpeg pour terminer son dernier fichier avant de le tuer
+# (en secondes)
+STOP_TIMEOUT = 5
+
+# Temps au bout duquel ffmpeg est considéré comme bloqué si le segment en
+# cours ne grossit plus (en secondes) : il est alors arrêté puis relancé
+STALL_TIMEOUT = 30
+
+# Attente avant de relancer un ffmpeg qui s'est arrêté de lui-même (en
+# secondes) : doublée à chaque nouvel arrêt, jusqu'à RESTART_DELAY_MAX, pour
+# ne pas relancer en boucle un ffmpeg qui échoue aussitôt (webcam débranchée,
+# encodeur absent...)
+RESTART_DELAY_MIN = 1
+RESTART_DELAY_MAX = 60
+
+# Dossier de travail du script (créé par systemd, voir RuntimeDirectory dans
+# dashcam.service) et lien symbolique vers la clé en cours d'utilisation
+# ffmpeg écrit à travers ce lien : pour changer de clé, il suffit de changer
+# la cible du lien, le segment suivant est créé sur la nouvelle clé
+RUN_DIR = os.environ.get("RUNTIME_DIRECTORY", "/tmp/dashcam")
+CURRENT_USB_LINK = os.path.join(RUN_DIR, "current")
+
+# Fichier où ffmpeg écrit ses erreurs (en mémoire, comme tout RUN_DIR : rien
+# n'est écrit sur les clés, qui peuvent être retirées à tout moment)
+FFMPEG_LOG = os.path.join(RUN_DIR, "ffmpeg.log")
+
+# Taille maximale de ce fichier (en octets) : au-delà, son contenu passe dans
+# ffmpeg.log.1 et il repart de zéro (voir rotate_ffmpeg_log). Une webcam USB
+# capricieuse peut produire une erreur de décodage à chaque image
+FFMPEG_LOG_MAX_BYTES = 1024 * 1024
+
 # Variable globale pour se souvenir de la dernière clé utilisée
 LAST_USED_USB = None
 
+# Demande d'arrêt du script (SIGTERM ou SIGINT, voir graceful_stop) : la
+# boucle de main() s'arrête dès qu'elle est levée
+STOP_REQUESTED = False
+
+# Tube qui reçoit un octet à la demande d'arrêt : toutes les attentes
+# (wait_for_stop, wait_for_mount) le surveillent et s'interrompent aussitôt
+# Jamais lu : une fois l'octet écrit, il reste "prêt" pour tous les threads
+# L'écriture ne bloque pas, même si des signaux arrivent en rafale
+STOP_PIPE_R, STOP_PIPE_W = os.pipe()
+os.set_blocking(STOP_PIPE_W, False)
+
+# Espace libre mémorisé pour chaque clé : {chemin: (espace_go, moment_mesure)}
+FREE_SPACE_CACHE = {}
+
+# Variables globales pour suivre le segment vidéo en cours d'écriture
+CURRENT_SEGMENT = None     # Chemin du fichier (ex: "/mnt/usb1/video_....mp4")
+CURRENT_SEGMENT_FD = None  # Descripteur ouvert sur ce fichier (ou None)
+OUTPUT_STATE = frozenset() # Fichiers ouverts par ffmpeg et leur taille (voir
+                           # segment_is_stalled)
+SEGMENT_GROWN_AT = 0       # Moment où cet état a changé pour la dernière fois
+
+# Segments déjà vus sur les clés (chemins complets) : un fichier qui n'y est
+# pas encore est le nouveau segment de ffmpeg (voir track_segment)
+KNOWN_SEGMENTS = set()
+
+# Place réservée au-delà de la fin d'un fichier (en octets) à partir de
+# laquelle elle est rendue à la clé au lancement de ffmpeg : au-dessous, c'est
+# le simple arrondi au bloc du système de fichiers
+LEFTOVER_RESERVE_BYTES = 1024 * 1024
+
+# Clés dont le système de fichiers ne sait pas réserver de place (exFAT monté
+# par exfat-fuse, par exemple) : inutile de réessayer à chaque segment
+NO_PREALLOC_USBS = set()
+
+# ---------- FONCTIONS SYSTÈME (libc) ----------
+# fallocate() n'existe pas dans le module os : on l'appelle dans la libc
+LIBC = ctypes.CDLL("libc.so.6", use_errno=True)
+LIBC.fallocate64.argtypes = [ctypes.c_int, ctypes.c_int,
+                             ctypes.c_int64, ctypes.c_int64]
+
+# Mode de fallocate() qui réserve la place SANS changer la taille du fichier
+FALLOC_FL_KEEP_SIZE = 1
+
+# sync_file_range() n'existe pas non plus dans le module os
+LIBC.sync_file_range.argtypes = [ctypes.c_int, ctypes.c_int64,
+                                 ctypes.c_int64, ctypes.c_uint]
+
+# Mode de sync_file_range() qui lance l'écriture sur la clé SANS l'attendre
+SYNC_FILE_RANGE_WRITE = 2
+
+
+# Copie de la "struct statvfs64" de la libc (voir "man statvfs")
+# os.statvfs() crée un nouvel objet Python à chaque appel : ici on relit
+# toujours la même structure, remplie directement par la libc
+class Statvfs(ctypes.Structure):
+    _fields_ = [
+        ("f_bsize", ctypes.c_ulong),     # Taille de bloc du système de fichiers
+        ("f_frsize", ctypes.c_ulong),    # Taille de fragment
+        ("f_blocks", ctypes.c_uint64),   # Nombre total de blocs
+        ("f_bfree", ctypes.c_uint64),    # Blocs libres
+        ("f_bavail", ctypes.c_uint64),   # Blocs libres pour un utilisateur normal
+        ("f_files", ctypes.c_uint64),    # Nombre total d'inodes
+        ("f_ffree", ctypes.c_uint64),    # Inodes libres
+        ("f_favail", ctypes.c_uint64),   # Inodes libres pour un utilisateur normal
+        ("f_fsid", ctypes.c_ulong),      # Identifiant du système de fichiers
+    ] + (
+        # Sur un système 32 bits (Raspberry Pi OS 32 bits), la libc ajoute
+        # un entier inutilisé à cet endroit
+        [("f_unused", ctypes.c_int)] if ctypes.sizeof(ctypes.c_void_p) == 4 else []
+    ) + [
+        ("f_flag", ctypes.c_ulong),      # Options de montage
+        ("f_namemax", ctypes.c_ulong),   # Longueur maximale d'un nom de fichier
+        ("f_spare", ctypes.c_int * 6),   # Réservé par la libc
+    ]
+
+
+LIBC.statvfs64.argtypes = [ctypes.c_char_p, ctypes.POINTER(Statvfs)]
+
+# Structure unique réutilisée à chaque appel (protégée par un verrou)
+STATVFS_BUF = Statvfs()
+STATVFS_LOCK = threading.Lock()
+
+# Identifiant du système de fichiers de la carte SD ("/")
+# Un dossier /mnt/usbX qui a le même identifiant n'a pas de clé montée dessus
+ROOT_FSID = os.statvfs("/").f_fsid
+
+# ioprio_set() n'existe ni dans le module os ni dans la libc : on passe par
+# syscall(), avec le numéro de l'appel système propre à la libc utilisée
+# Raspberry Pi OS 32 bits tourne souvent sur un noyau 64 bits (Pi 3, 4) :
+# os.uname() dit alors "aarch64", c'est donc la taille d'un pointeur (comme
+# pour Statvfs) qui indique si Python et la libc sont en 32 bits
+if ctypes.sizeof(ctypes.c_void_p) == 4:
+    SYS_IOPRIO_SET = 314  # Raspberry Pi OS 32 bits (ARM EABI)
+else:
+    SYS_IOPRIO_SET = {
+        "aarch64": 30,    # Raspberry Pi OS 64 bits
+        "x86_64": 251,    # PC (pour les essais)
+    }.get(os.uname().machine)
+
+# Classe "temps réel" des entrées/sorties, niveau 4 (de 0 à 7) :
+# valeur = (classe << 13) | niveau, voir "man ioprio_set"
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_RT_LEVEL_4 = (1 << 13) | 4
+
+# Journal des messages : l'heure n'est calculée que si le message est affiché
+log = logging.getLogger("dashcam")
+
 
 # ============================================================================
-# FONCTION : get_free_space_gb
+# FONCTION : has_h264_hw_encoder
 # ============================================================================
-# Rôle : Calculer l'espace disponible sur une clé USB en Go
-# Paramètre : path = chemin vers la clé USB (ex: "/mnt/usb1")
-# Retourne : Espace libre en Go (ex: 58.5), ou 0 si erreur
+# Rôle : Vérifier que l'encodeur matériel H.264 du Raspberry Pi fonctionne
+#        (h264_v4l2m2m, qui utilise le GPU VideoCore au lieu du processeur)
+# Retourne : True si l'encodeur a pu encoder une image d'essai, False sinon
 # ============================================================================
-def get_free_space_gb(path):
-    """Retourne l'espace disponible en Go sur le chemin spécifié"""
+def has_h264_hw_encoder():
+    """Indique si l'encodeur matériel h264_v4l2m2m est disponible"""
     
     try:
-        # os.statvfs() récupère les statistiques du système de fichiers
-        stat = os.statvfs(path)
+        # "ffmpeg -encoders" ne suffit pas : il liste h264_v4l2m2m dès que
+        # ffmpeg a été compilé avec, même sans encodeur sur la carte (Pi 5,
+        # PC...). On encode donc pour de vrai une seule image noire
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error",
+                                 "-f", "lavfi", "-i",
+                                 f"nullsrc=s={VIDEO_WIDTH}x{VIDEO_HEIGHT}",
+                                 "-frames:v", "1",
+                                 "-c:v", "h264_v4l2m2m", "-pix_fmt", "yuv420p",
+                                 "-f", "null", "-"],
+                                stdin=subprocess.DEVNULL, capture_output=True,
+                                timeout=10)
+        return result.returncode == 0
         
-        # Calcul de l'espace libre en octets
-        free_bytes = stat.f_bavail * stat.f_frsize
-        
-        # Conversion des octets en Go (1 Go = 1024^3 octets)
-        free_gb = free_bytes / (1024**3)
+    except (OSError, subprocess.TimeoutExpired):
+        # ffmpeg introuvable ou bloqué : on ne peut pas savoir, on reste sur MJPEG
+        return False
+
+
+# Détection faite UNE SEULE FOIS au démarrage du script
+# Si l'encodeur manque, on garde l'ancien mode (copie MJPEG sans ré-encodage)
+H264_HW_AVAILABLE = has_h264_hw_encoder()
+
+# Taille estimée d'un segment de 5 minutes (en octets), réservée d'un coup
+# sur la clé au début de chaque segment
+if H264_HW_AVAILABLE:
+    ESTIMATED_SEGMENT_BYTES = VIDEO_DURATION * H264_BITRATE // 8
+else:
+    ESTIMATED_SEGMENT_BYTES = VIDEO_DURATION * MJPEG_BITRATE // 8
+
+
+# ---------- COMMANDE FFMPEG (préparée une seule fois au démarrage) ----------
+# Seule la clé change d'un enregistrement à l'autre, et elle est choisie par
+# le lien CURRENT_USB_LINK : la commande complète est donc fixe
+
+# Codec vidéo
+if H264_HW_AVAILABLE:
+    # Ré-encodage H.264 : fichiers 10 à 20 fois plus petits qu'en MJPEG
+    # Seul l'encodage se fait sur le GPU : la webcam envoie du MJPEG, chaque
+    # image est donc d'abord décodée PAR LE PROCESSEUR puis convertie en
+    # yuv420p (threads -filter_threads), avant d'être confiée à l'encodeur.
+    # C'est cette partie qui occupe les cœurs de ffmpeg
+    CODEC_ARGS = (
+        "-c:v", "h264_v4l2m2m",      # Codec vidéo : encodeur matériel du Pi
+        "-b:v", str(H264_BITRATE),   # Débit vidéo : 4 Mbit/s
+        "-pix_fmt", "yuv420p",       # Format de pixels attendu par l'encodeur
+        # Le découpage ne peut couper que sur une image complète (image clé) :
+        # on en force une toutes les VIDEO_DURATION secondes pour que chaque
+        # segment fasse exactement 5 minutes
+        "-force_key_frames", f"expr:gte(t,n_forced*{VIDEO_DURATION})",
+    )
+else:
+    # Pas d'encodeur matériel : on copie le flux MJPEG tel quel
+    CODEC_ARGS = (
+        "-c:v", "copy",              # Codec vidéo : "copy" = pas de ré-encodage
+    )
+
+# Options du découpage, transmises au muxer "segment" à travers le muxer
+# "fifo" sous la forme "option1=valeur1:option2=valeur2:..."
+SEGMENT_OPTS = ":".join((
+    f"segment_time={VIDEO_DURATION}",   # Durée d'un segment : 300 s
+    # Tolérance sur l'heure de coupure (en secondes) : l'image clé forcée
+    # à 300 s peut tomber un peu avant, elle doit quand même être retenue
+    "segment_time_delta=0.05",
+    "segment_format=mp4",               # Format conteneur de chaque segment
+    # Pas d'option "faststart" : elle rouvre le fichier par son nom à la
+    # fin du segment, ce qui échoue si le lien a changé de clé entre-temps
+    # MP4 fragmenté : l'index est écrit toutes les 2 secondes au lieu d'une
+    # seule fois à la fermeture du fichier. Si le courant est coupé, on ne
+    # perd que les dernières secondes au lieu du segment entier
+    # (delay_moov : l'encodeur du GPU ne donne les paramètres H.264 qu'avec
+    # la première image, l'en-tête est donc écrit juste après elle)
+    # Le "\:" sépare les options du MP4 sans couper celles du découpage
+    "segment_format_options=movflags=+frag_keyframe+empty_moov"
+    "+default_base_moof+delay_moov\\:frag_duration=2000000",
+    "reset_timestamps=1",               # Chaque fichier commence à 00:00:00
+    "strftime=1",                       # Nom de fichier avec la date de début
+))
+
+# On a retiré toutes les options liées à l'audio (alsa, -c:a, -ar, -ac...)
+FFMPEG_CMD = (
+    "ffmpeg",
+    
+    # --- MESSAGES ---
+    # Seulement les erreurs : ni bannière ni ligne de progression "frame=..."
+    # réécrite plusieurs fois par seconde
+    "-hide_banner",
+    "-loglevel", "error",
+    "-nostats",
+    
+    # --- THREADS ---
+    "-filter_threads", str(FFMPEG_THREADS),  # Conversion d'image (yuv420p)
+    
+    # --- ENTRÉE VIDÉO (webcam) ---
+    "-f", "v4l2",                    # Format : Video4Linux2 (standard Linux)
+    "-input_format", "mjpeg",        # Format d'entrée : MJPEG (Motion JPEG)
+    "-video_size", f"{VIDEO_WIDTH}x{VIDEO_HEIGHT}",  # Résolution : 1280x720
+    "-thread_queue_size", str(INPUT_QUEUE_SIZE),  # File de lecture : 512 images
+    "-fflags", "nobuffer",           # Pas d'images mises de côté au démarrage :
+                                     # l'enregistrement commence sur des images fraîches
+    "-i", DEVICE,                    # Périphérique vidéo : /dev/video0
+    
+    # --- CODEC VIDÉO ---
+    "-map", "0:v",                   # Flux vidéo de la webcam (à préciser avec "fifo")
+    *CODEC_ARGS,
+    "-threads", str(FFMPEG_THREADS), # Threads d'encodage : 2 sur un Pi 3
+    
+    # --- TAMPON D'ÉCRITURE ---
+    # Le muxer "fifo" écrit les fichiers dans un thread séparé : les images
+    # s'accumulent en mémoire quand la clé USB est lente, au lieu de
+    # bloquer la capture et de perdre des images
+    "-f", "fifo",                    # Format : file d'attente avant écriture
+    "-queue_size", str(WRITE_QUEUE_SIZE),  # Taille de la file : 600 images
+    
+    # --- DÉCOUPAGE EN SEGMENTS ---
+    # ffmpeg garde la webcam ouverte et change de fichier tout seul :
+    # plus de coupure (ni d'image perdue) entre deux vidéos
+    "-fifo_format", "segment",       # Format réel : découpage en plusieurs fichiers
+    "-format_opts", SEGMENT_OPTS,
+    
+    # --- FICHIERS DE SORTIE ---
+    # Les %Y%m%d_%H%M%S sont remplacés par ffmpeg lui-même (option strftime)
+    # à l'ouverture de chaque nouveau segment
+    # Dans les deux cas (H.264 ou MJPEG), un seul type de fichier : MP4
+    os.path.join(CURRENT_USB_LINK, "video_%Y%m%d_%H%M%S.mp4"),
+)
+
+
+# ============================================================================
+# FONCTION : get_free_space_gb
+# ============================================================================
+# Rôle : Vérifier qu'une clé USB est montée et calculer son espace disponible
+#        en Go (la valeur est mémorisée FREE_SPACE_CACHE_TTL secondes)
+# Paramètres : path = chemin vers la clé USB (ex: "/mnt/usb1")
+#              max_age = âge maximum (en secondes) d'une mesure mémorisée
+#                        pour être réutilisée (0 = toujours remesurer)
+# Retourne : Espace libre en Go (ex: 58.5), ou None si aucune clé n'est montée
+# ============================================================================
+def get_free_space_gb(path, max_age=FREE_SPACE_CACHE_TTL):
+    """Retourne l'espace disponible en Go sur le chemin spécifié"""
+    
+    # Valeur mesurée il y a moins de max_age secondes : on la garde
+    cached = FREE_SPACE_CACHE.get(path)
+    if cached and time.monotonic() - cached[1] < max_age:
+        return cached[0]
+    
+    with STATVFS_LOCK:
+        # statvfs64() de la libc remplit STATVFS_BUF avec les statistiques
+        # du système de fichiers (0 = succès)
+        if LIBC.statvfs64(os.fsencode(path), ctypes.byref(STATVFS_BUF)) != 0:
+            # En cas d'erreur (dossier absent, clé arrachée...), pas de clé
+            return None
         
-        return free_gb
+        # Un seul appel suffit aussi à savoir si une clé est montée : sinon
+        # le dossier appartient au système de fichiers de la carte SD
+        if not STATVFS_BUF.f_blocks or STATVFS_BUF.f_fsid == ROOT_FSID:
+            return None
         
-    except:
-        # En cas d'erreur (clé non montée, etc.), retourne 0
-        return 0
+        # Calcul de l'espace libre en octets
+        free_bytes = STATVFS_BUF.f_bavail * STATVFS_BUF.f_frsize
+    
+    # Conversion des octets en Go (1 Go = 1024^3 octets)
+    free_gb = free_bytes / (1024**3)
+    
+    # Mémoriser la mesure pour les prochains appels
+    FREE_SPACE_CACHE[path] = (free_gb, time.monotonic())
+    
+    return free_gb
 
 
 # ============================================================================
@@ -71,6 +438,8 @@ def get_free_space_gb(path):
 # ============================================================================
 # Rôle : Choisir automatiquement quelle clé USB utiliser pour enregistrer
 # Logique : 
+#   0. Si la dernière clé a encore LARGEMENT assez d'espace (mesure récente),
+#      continue dessus sans rien revérifier
 #   1. Vérifie les deux clés USB
 #   2. Si une clé était déjà utilisée et a encore assez d'espace, continue dessus
 #   3. Sinon, choisit celle avec le PLUS d'espace disponible
@@ -80,139 +449,716 @@ def select_usb_path():
     """Sélectionne la clé USB avec le plus d'espace disponible"""
     global LAST_USED_USB  # Accès à la variable globale
     
-    # Liste qui va contenir les clés disponibles et leur espace libre
-    available_usbs = []
+    # ---------- ÉTAPE 0 : Raccourci si la dernière clé est loin d'être pleine ----------
+    if LAST_USED_USB:
+        cached = FREE_SPACE_CACHE.get(LAST_USED_USB)
+        if (cached and time.monotonic() - cached[1] < FREE_SPACE_CACHE_TTL
+                and cached[0] >= 2 * MIN_FREE_SPACE_GB):
+            return LAST_USED_USB
+    
+    # Clés disponibles et leur espace libre, dans deux listes parallèles :
+    # frees[i] est l'espace libre (en Go) de la clé paths[i]
+    paths = []
+    frees = array.array("d")
     
     # ---------- ÉTAPE 1 : Vérifier chaque clé USB ----------
     for usb_path in USB_PATHS:
         
-        # Vérifier si le chemin existe ET si la clé est bien montée
-        if os.path.exists(usb_path) and os.path.ismount(usb_path):
-            
-            # Calculer l'espace libre sur cette clé
-            free_space = get_free_space_gb(usb_path)
-            
-            available_usbs.append((usb_path, free_space))
+        # Calculer l'espace libre sur cette clé (None si elle n'est pas montée)
+        free_space = get_free_space_gb(usb_path)
+        
+        if free_space is not None:
+            paths.append(usb_path)
+            frees.append(free_space)
             
             # Afficher l'espace disponible pour information
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-                  f"{usb_path}: {free_space:.2f} Go disponibles")
+            log.info("%s: %.2f Go disponibles", usb_path, free_space)
     
     # Si aucune clé n'est détectée, retourner None
-    if not available_usbs:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-              f"ERREUR: Aucune clé USB détectée")
+    if not paths:
+        log.error("ERREUR: Aucune clé USB détectée")
         return None
     
     # ---------- ÉTAPE 2 : Continuer sur la dernière clé si possible ----------
-    if LAST_USED_USB:
-        for usb_path, free_space in available_usbs:
-            if usb_path == LAST_USED_USB and free_space >= MIN_FREE_SPACE_GB:
-                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-                      f"Continue sur: {usb_path}")
-                return usb_path
+    if LAST_USED_USB in paths:
+        if frees[paths.index(LAST_USED_USB)] >= MIN_FREE_SPACE_GB:
+            log.info("Continue sur: %s", LAST_USED_USB)
+            return LAST_USED_USB
     
     # ---------- ÉTAPE 3 : Sinon, choisir celle avec le PLUS d'espace ----------
-    # Trier la liste par espace disponible (du plus grand au plus petit)
-    available_usbs.sort(key=lambda x: x[1], reverse=True)
-    
-    # Prendre la première clé de la liste (celle avec le plus d'espace)
-    selected_usb = available_usbs[0][0]
+    # Prendre la clé avec le plus d'espace disponible : max() parcourt le
+    # tableau des espaces libres une seule fois, sans le trier, et sa
+    # position donne la clé correspondante
+    selected_usb = paths[frees.index(max(frees))]
     
     # Mémoriser ce choix pour les prochains enregistrements
     LAST_USED_USB = selected_usb
     
     # Afficher quelle clé a été choisie
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-          f"Clé sélectionnée: {selected_usb}")
+    log.info("Clé sélectionnée: %s", selected_usb)
     
     return selected_usb
 
 
 # ============================================================================
-# FONCTION : record_video
+# FONCTION : set_current_usb
+# ============================================================================
+# Rôle : Faire pointer le lien CURRENT_USB_LINK vers la clé à utiliser
+# Paramètre : usb_path = chemin de la clé (ex: "/mnt/usb1")
+# ============================================================================
+def set_current_usb(usb_path):
+    """Change la clé sur laquelle ffmpeg créera ses prochains segments"""
+    
+    os.makedirs(RUN_DIR, exist_ok=True)
+    
+    # On crée le nouveau lien à côté puis on le renomme par-dessus l'ancien :
+    # le remplacement est instantané, ffmpeg ne voit jamais de lien absent
+    tmp_link = CURRENT_USB_LINK + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(usb_path, tmp_link)
+    os.replace(tmp_link, CURRENT_USB_LINK)
+
+
+# ============================================================================
+# FONCTION : set_thread_priority
+# ============================================================================
+# Rôle : Régler un thread de ffmpeg pour qu'il passe avant les tâches de fond
+#        (cron, mises à jour...) et ne perde aucune image de la webcam
+#        - cœurs : seulement FFMPEG_CPUS (ni le cœur 0, ni celui du script)
+#        - processeur : temps réel (SCHED_FIFO)
+#        - écritures sur la clé : classe temps réel (ioprio)
+#        TOUS les threads sont concernés, pas seulement la capture : aussi
+#        ceux du décodage MJPEG et de la conversion yuv420p, qui travaillent
+#        en continu. Tant qu'ils tournent, les tâches normales des cœurs
+#        FFMPEG_CPUS n'ont que ce que laisse la limite du noyau sur le temps
+#        réel (sched_rt_runtime_us : 5 % du temps par défaut)
+# Paramètre : tid = numéro du thread
+# ============================================================================
+def set_thread_priority(tid):
+    """Donne à un thread les cœurs, la priorité et l'ioprio de ffmpeg"""
+    
+    # Toujours autorisé : le thread appartient au même utilisateur
+    os.sched_setaffinity(tid, FFMPEG_CPUS)
+    
+    # Demande CAP_SYS_NICE (voir AmbientCapabilities dans dashcam.service)
+    os.sched_setscheduler(tid, os.SCHED_FIFO,
+                          os.sched_param(FFMPEG_RT_PRIORITY))
+    
+    if SYS_IOPRIO_SET is not None:
+        if LIBC.syscall(ctypes.c_long(SYS_IOPRIO_SET),
+                        ctypes.c_long(IOPRIO_WHO_PROCESS), ctypes.c_long(tid),
+                        ctypes.c_long(IOPRIO_RT_LEVEL_4)) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+
+# ============================================================================
+# FONCTION : raise_priority
+# ============================================================================
+# Rôle : Appliquer set_thread_priority à tous les threads d'un processus
+# Paramètre : pid = numéro du processus (ffmpeg)
+# ============================================================================
+def raise_priority(pid):
+    """Passe tous les threads du processus en priorité temps réel"""
+    
+    try:
+        # Un nouveau thread copie les réglages du thread qui le crée : on
+        # règle d'abord le thread principal (même numéro que le processus),
+        # les threads qu'il créera ensuite en hériteront...
+        set_thread_priority(pid)
+        
+        # ...puis ceux qu'il a déjà créés
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            try:
+                set_thread_priority(int(tid))
+            except ProcessLookupError:
+                # Ce thread vient de se terminer : on passe aux suivants
+                pass
+            
+    except PermissionError:
+        log.warning("Priorité temps réel refusée (CAP_SYS_NICE manquant) : "
+                    "ffmpeg tourne en priorité normale")
+    except (ProcessLookupError, FileNotFoundError):
+        # ffmpeg s'est déjà arrêté : main() s'en apercevra
+        pass
+    except OSError as e:
+        log.warning("Priorité temps réel impossible: %s", e)
+
+
 # ============================================================================
-# Rôle : Enregistrer UNE vidéo de 5 minutes SANS audio sur la clé USB spécifiée
+# FONCTION : start_continuous_recording
+# ============================================================================
+# Rôle : Lancer UN SEUL processus ffmpeg qui enregistre en continu (vidéo seule)
+#        et découpe lui-même les fichiers toutes les 5 minutes (muxer "segment")
 # Paramètre : usb_path = chemin de la clé où enregistrer (ex: "/mnt/usb1")
-# Retourne : True si succès, False si erreur
+# Retourne : Le processus ffmpeg lancé (subprocess.Popen), ou None si erreur
 # ============================================================================
-def record_video(usb_path):
-    """Enregistre une vidéo MJPEG de 5 minutes (vidéo seule)"""
+def start_continuous_recording(usb_path):
+    """Lance un ffmpeg unique qui découpe la vidéo en segments de 5 minutes"""
+    
+    # ---------- ÉTAPE 1 : Diriger les segments vers la clé choisie ----------
+    # La commande ffmpeg (FFMPEG_CMD) est toujours la même : elle écrit à
+    # travers le lien CURRENT_USB_LINK, qu'on fait pointer vers la clé
+    set_current_usb(usb_path)
+    
+    log.info("Début enregistrement continu (vidéo seule) sur %s", usb_path)
+    
+    # ---------- ÉTAPE 2 : Lancer ffmpeg en arrière-plan ----------
+    # Les fichiers déjà présents sur la clé ne doivent pas être suivis :
+    # seuls les segments créés par ce ffmpeg le seront (voir track_segment)
+    global KNOWN_SEGMENTS, SEGMENT_GROWN_AT
+    KNOWN_SEGMENTS = list_segments(usb_path)
     
-    # ---------- ÉTAPE 1 : Créer le nom du fichier ----------
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"video_{timestamp}.avi"
-    filepath = os.path.join(usb_path, filename)
+    # ffmpeg a STALL_TIMEOUT secondes pour commencer à écrire
+    SEGMENT_GROWN_AT = time.monotonic()
     
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-          f"Début enregistrement (vidéo seule): {filename} sur {usb_path}")
+    # Si le script a été coupé brutalement, le dernier segment peut encore
+    # avoir de la place réservée en trop : on la rend à la clé
+    # (on le reconnaît à ses blocs réservés, pas à son nom : l'horloge du Pi
+    # peut repartir en arrière après une coupure de courant)
+    for filepath in KNOWN_SEGMENTS:
+        try:
+            st = os.stat(filepath)
+            if st.st_blocks * 512 - st.st_size > LEFTOVER_RESERVE_BYTES:
+                os.truncate(filepath, st.st_size)
+        except OSError:
+            pass
     
-    # ---------- ÉTAPE 2 : Préparer la commande ffmpeg ----------
-    # On a retiré toutes les options liées à l'audio (alsa, -c:a, -ar, -ac...)
-    cmd = [
-        "ffmpeg",
+    # Chaque lancement repart d'un journal vide : celui du ffmpeg précédent
+    # est gardé dans ffmpeg.log.1
+    rotate_ffmpeg_log()
+    
+    try:
+        # stdin=DEVNULL : ffmpeg ne doit pas lire le clavier (il s'arrêterait
+        # sur la touche "q")
+        # stdout=DEVNULL, stderr=FFMPEG_LOG : ffmpeg n'écrit jamais vers le
+        # terminal ou le journal, il ne peut donc pas rester bloqué dessus
+        # start_new_session=True : un Ctrl+C dans le terminal n'atteint que ce
+        # script, qui transmet lui-même UN SEUL SIGINT à ffmpeg (au deuxième
+        # signal, ffmpeg abandonne l'écriture du fichier en cours)
+        with open(FFMPEG_LOG, "ab") as ffmpeg_log:
+            proc = subprocess.Popen(FFMPEG_CMD,
+                                    stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.DEVNULL,
+                                    stderr=ffmpeg_log,
+                                    start_new_session=True)
         
-        # --- ENTRÉE VIDÉO (webcam) ---
-        "-f", "v4l2",                # Format : Video4Linux2 (standard Linux)
-        "-input_format", "mjpeg",    # Format d'entrée : MJPEG (Motion JPEG)
-        "-video_size", f"{VIDEO_WIDTH}x{VIDEO_HEIGHT}",  # Résolution : 1280x720
-        "-i", DEVICE,                # Périphérique vidéo : /dev/video0
+    except OSError as e:
+        log.error("Erreur de lancement de ffmpeg: %s", e)
+        return None
+    
+    # ---------- ÉTAPE 3 : Faire passer ffmpeg avant le reste du système ----------
+    raise_priority(proc.pid)
+    
+    return proc
+
+
+# ============================================================================
+# FONCTION : rotate_ffmpeg_log
+# ============================================================================
+# Rôle : Empêcher le journal d'erreurs de ffmpeg de grossir sans fin (il est
+#        en mémoire) : son contenu est copié dans ffmpeg.log.1 puis il est vidé
+#        ffmpeg l'a ouvert en ajout ("ab") : il continue d'écrire normalement
+#        dans le fichier vidé, sans avoir à le rouvrir
+# Paramètre : max_bytes = taille au-delà de laquelle le journal est vidé
+#             (0 = dès qu'il contient quelque chose)
+# ============================================================================
+def rotate_ffmpeg_log(max_bytes=0):
+    """Copie le journal de ffmpeg dans ffmpeg.log.1 et le vide"""
+    
+    try:
+        if os.path.getsize(FFMPEG_LOG) > max_bytes:
+            shutil.copyfile(FFMPEG_LOG, FFMPEG_LOG + ".1")
+            os.truncate(FFMPEG_LOG, 0)
+    except OSError:
+        # Pas encore de journal (premier lancement) : rien à faire
+        pass
+
+
+# ============================================================================
+# FONCTION : stop_recording
+# ============================================================================
+# Rôle : Arrêter proprement le processus ffmpeg en cours
+# Paramètre : proc = processus ffmpeg renvoyé par start_continuous_recording
+# ============================================================================
+def stop_recording(proc):
+    """Arrête ffmpeg proprement pour que le dernier segment reste lisible"""
+    global CURRENT_SEGMENT, CURRENT_SEGMENT_FD  # Accès aux variables globales
+    
+    # SIGINT (comme un Ctrl+C) laisse ffmpeg terminer le fichier en cours
+    proc.send_signal(signal.SIGINT)
+    
+    try:
+        proc.wait(timeout=STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        # ffmpeg ne répond plus : on le tue
+        proc.kill()
         
-        # --- DURÉE D'ENREGISTREMENT ---
-        "-t", str(VIDEO_DURATION),   # Durée : 300 secondes (5 minutes)
+        try:
+            proc.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            # Même SIGKILL n'agit pas : ffmpeg est coincé dans le noyau (clé
+            # arrachée en pleine écriture...). Vider le segment sur cette clé
+            # bloquerait aussi ce script : on abandonne le fichier, sans le
+            # refermer, pour pouvoir relancer l'enregistrement
+            CURRENT_SEGMENT = None
+            CURRENT_SEGMENT_FD = None
+            log.error("ERREUR: ffmpeg ne répond plus, même à SIGKILL")
+            return
+    
+    # ffmpeg a refermé son dernier fichier : on peut le terminer aussi
+    close_segment()
+    
+    log.info("Enregistrement arrêté")
+
+
+# ============================================================================
+# FONCTION : graceful_stop
+# ============================================================================
+# Rôle : Gestionnaire des signaux SIGTERM (systemctl stop, extinction) et
+#        SIGINT (Ctrl+C) : demande à main() de s'arrêter
+#        Le travail (arrêt de ffmpeg, fin du segment) est fait par main()
+#        elle-même : le signal peut tomber n'importe où, même au milieu de
+#        close_segment ou de l'écriture d'un message
+#        Pas de threading.Event ici : son verrou est peut-être déjà tenu par
+#        le code interrompu, le gestionnaire resterait bloqué dessus. Une
+#        variable et une écriture dans un tube ne prennent aucun verrou
+# Paramètres : signum, frame = fournis par le module signal (inutilisés)
+# ============================================================================
+def graceful_stop(signum, frame):
+    """Demande l'arrêt propre du script"""
+    global STOP_REQUESTED  # Accès à la variable globale
+    
+    STOP_REQUESTED = True
+    
+    try:
+        os.write(STOP_PIPE_W, b"x")
+    except BlockingIOError:
+        # Tube plein : il contient déjà de quoi réveiller les attentes
+        pass
+
+
+# ============================================================================
+# FONCTION : wait_for_stop
+# ============================================================================
+# Rôle : Attendre sans rien faire, en s'interrompant dès que l'arrêt du
+#        script est demandé (utilisable depuis n'importe quel thread)
+# Paramètre : timeout = attente maximale en secondes
+# Retourne : True si l'arrêt est demandé, False sinon
+# ============================================================================
+def wait_for_stop(timeout):
+    """Attend timeout secondes, ou moins si l'arrêt est demandé"""
+    
+    select.select([STOP_PIPE_R], [], [], timeout)
+    
+    return STOP_REQUESTED
+
+
+# ============================================================================
+# FONCTION : list_segments
+# ============================================================================
+# Rôle : Lister les segments vidéo présents sur une clé USB
+# Paramètre : usb_path = chemin de la clé (ex: "/mnt/usb1")
+# Retourne : L'ensemble des chemins des fichiers (vide si la clé est illisible)
+# ============================================================================
+def list_segments(usb_path):
+    """Retourne les chemins des segments vidéo de la clé"""
+    
+    try:
+        return {entry.path for entry in os.scandir(usb_path)
+                if entry.name.startswith("video_")}
+    except OSError:
+        return set()
+
+
+# ============================================================================
+# FONCTION : preallocate_segment
+# ============================================================================
+# Rôle : Réserver d'un coup sur la clé la place d'un segment complet
+#        (la FAT/exFAT n'alloue alors qu'une seule zone contiguë au lieu de
+#        faire grossir le fichier bloc par bloc)
+# Paramètre : filepath = chemin du segment que ffmpeg vient de créer
+# Retourne : Le descripteur ouvert sur le fichier, ou None si erreur
+# ============================================================================
+def preallocate_segment(filepath):
+    """Réserve la place d'un segment sans changer la taille du fichier"""
+    
+    try:
+        fd = os.open(filepath, os.O_WRONLY)
+    except OSError:
+        return None
+    
+    usb_path = os.path.dirname(filepath)
+    if usb_path in NO_PREALLOC_USBS:
+        return fd
+    
+    # FALLOC_FL_KEEP_SIZE : la taille visible du fichier ne change pas,
+    # ffmpeg continue donc d'écrire normalement à la suite
+    if LIBC.fallocate64(fd, FALLOC_FL_KEEP_SIZE, 0, ESTIMATED_SEGMENT_BYTES) != 0:
+        err = ctypes.get_errno()
         
-        # --- CODEC VIDÉO ---
-        "-c:v", "copy",              # Codec vidéo : "copy" = pas de ré-encodage
-                                     # On copie le flux MJPEG tel quel (rapide et fiable)
+        if err == errno.EOPNOTSUPP:
+            # Ne changera pas tant que la clé reste montée de la même façon :
+            # un seul message, puis on n'essaie plus sur cette clé
+            NO_PREALLOC_USBS.add(usb_path)
+            log.warning("Préallocation non prise en charge sur %s", usb_path)
+        else:
+            log.warning("Préallocation impossible: %s", os.strerror(err))
+    
+    # On garde le fichier ouvert jusqu'à la fin du segment : certains
+    # systèmes de fichiers libèrent la réserve à la fermeture
+    return fd
+
+
+# ============================================================================
+# FONCTION : close_segment
+# ============================================================================
+# Rôle : Terminer le suivi du segment en cours (ffmpeg a fini de l'écrire) :
+#        - rendre à la clé la place réservée mais non utilisée
+#        - écrire le fichier sur la clé puis le retirer de la mémoire cache
+#          (le Pi 3 n'a que 1 Go de RAM et la vidéo ne sera pas relue)
+# ============================================================================
+def close_segment():
+    """Libère la place réservée en trop et ferme le segment en cours"""
+    global CURRENT_SEGMENT, CURRENT_SEGMENT_FD  # Accès aux variables globales
+    
+    if CURRENT_SEGMENT_FD is not None:
+        try:
+            # Tronquer à la taille actuelle libère les blocs réservés au-delà
+            os.ftruncate(CURRENT_SEGMENT_FD, os.fstat(CURRENT_SEGMENT_FD).st_size)
+        except OSError:
+            pass
         
-        # --- FORMAT DE SORTIE ---
-        "-f", "avi",                 # Format conteneur : AVI
+        try:
+            # Forcer l'écriture sur la clé de ce qui est encore en mémoire...
+            os.fdatasync(CURRENT_SEGMENT_FD)
+            
+            # ...puis dire au système que ces pages ne serviront plus : elles
+            # quittent le cache au lieu d'occuper la RAM du prochain segment
+            os.posix_fadvise(CURRENT_SEGMENT_FD, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
         
-        filepath                     # Chemin complet du fichier de sortie
-    ]
+        os.close(CURRENT_SEGMENT_FD)
     
-    # ---------- ÉTAPE 3 : Lancer l'enregistrement ----------
-    try:
-        subprocess.run(cmd, check=True)
+    CURRENT_SEGMENT = None
+    CURRENT_SEGMENT_FD = None
+
+
+# ============================================================================
+# FONCTION : track_segment
+# ============================================================================
+# Rôle : Repérer quand ffmpeg passe au segment suivant
+#        - le segment précédent est terminé : on le referme (close_segment)
+#        - le nouveau segment vient d'être créé : on lui réserve sa place
+# Paramètre : usb_path = clé sur laquelle ffmpeg écrit
+# ============================================================================
+def track_segment(usb_path):
+    """Suit le changement de segment de ffmpeg"""
+    global CURRENT_SEGMENT, CURRENT_SEGMENT_FD  # Accès aux variables globales
+    
+    # Le nouveau segment est le fichier qui n'existait pas encore : on ne
+    # compare pas les noms, qui contiennent la date, car l'horloge du Pi (sans
+    # pile) peut redémarrer AVANT la date des fichiers déjà sur la clé
+    new_segments = list_segments(usb_path) - KNOWN_SEGMENTS
+    
+    # Rien de nouveau : ffmpeg écrit toujours dans le même fichier
+    if not new_segments:
+        return
+    
+    KNOWN_SEGMENTS.update(new_segments)
+    
+    close_segment()
+    
+    # Normalement un seul fichier ; s'il y en a plusieurs, le plus grand nom
+    # est le dernier créé par ce ffmpeg (son horloge n'a pas reculé entre-temps)
+    CURRENT_SEGMENT = max(new_segments)
+    CURRENT_SEGMENT_FD = preallocate_segment(CURRENT_SEGMENT)
+
+
+# ============================================================================
+# FONCTION : drip_sync
+# ============================================================================
+# Rôle : Envoyer vers la clé, toutes les DRIP_INTERVAL secondes, ce que ffmpeg
+#        a écrit dans le segment en cours (tourne dans un thread séparé)
+#        Sans cela, le noyau garde jusqu'à 30 secondes de vidéo en mémoire
+#        puis les écrit d'un coup : la clé sature et ffmpeg prend du retard
+# ============================================================================
+def drip_sync():
+    """Écrit le segment en cours sur la clé au fil de l'eau"""
+    
+    path = None  # Segment suivi par ce thread
+    fd = None    # Descripteur à lui, pour ne pas dépendre de close_segment
+    
+    # wait_for_stop() renvoie True dès que l'arrêt est demandé
+    while not wait_for_stop(DRIP_INTERVAL):
         
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-              f"Enregistrement terminé: {filename}")
-        return True
+        # Nouveau segment : on lâche l'ancien et on ouvre le nouveau
+        segment = CURRENT_SEGMENT
+        if segment != path:
+            if fd is not None:
+                os.close(fd)
+                fd = None
+            
+            path = segment
+            if path:
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                except OSError:
+                    pass
         
-    except subprocess.CalledProcessError as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-              f"Erreur d'enregistrement: {e}")
+        # Longueur 0 = jusqu'à la fin du fichier
+        if fd is not None:
+            LIBC.sync_file_range(fd, 0, 0, SYNC_FILE_RANGE_WRITE)
+
+
+# ============================================================================
+# FONCTION : segment_is_stalled
+# ============================================================================
+# Rôle : Repérer un ffmpeg bloqué : toujours en vie, mais qui n'écrit plus
+#        rien (webcam figée, clé qui ne répond plus...)
+#        On regarde les fichiers que ffmpeg a VRAIMENT ouverts sur les clés
+#        (/proc/<pid>/fd), pas le segment suivi par track_segment : une
+#        erreur de suivi ne doit pas faire tuer un ffmpeg qui fonctionne
+# Paramètre : pid = numéro du processus ffmpeg
+# Retourne : True si ces fichiers n'ont ni grossi ni changé depuis
+#            STALL_TIMEOUT secondes, False sinon
+# ============================================================================
+def segment_is_stalled(pid):
+    """Indique si ffmpeg a cessé d'écrire sur les clés"""
+    global OUTPUT_STATE, SEGMENT_GROWN_AT  # Accès aux variables globales
+    
+    usb_prefixes = tuple(os.path.join(usb_path, "") for usb_path in USB_PATHS)
+    fd_dir = f"/proc/{pid}/fd"
+    
+    # (chemin, taille) de chaque fichier ouvert par ffmpeg sur une clé
+    state = set()
+    try:
+        for fd in os.listdir(fd_dir):
+            link = os.path.join(fd_dir, fd)
+            try:
+                target = os.readlink(link)
+                if target.startswith(usb_prefixes):
+                    state.add((target, os.stat(link).st_size))
+            except OSError:
+                # Descripteur refermé entre-temps
+                pass
+    except OSError:
+        # ffmpeg vient de s'arrêter : main() s'en apercevra
+        pass
+    
+    # Fichier qui grossit, ou nouveau fichier : tout va bien
+    if state != OUTPUT_STATE:
+        OUTPUT_STATE = frozenset(state)
+        SEGMENT_GROWN_AT = time.monotonic()
         return False
+    
+    return time.monotonic() - SEGMENT_GROWN_AT > STALL_TIMEOUT
+
+
+# ============================================================================
+# FONCTION : wait_for_mount
+# ============================================================================
+# Rôle : Attendre qu'un système de fichiers soit monté ou démonté (une clé
+#        vient d'être branchée...), au lieu de revérifier les clés en boucle
+#        L'attente s'arrête aussi dès que l'arrêt du script est demandé
+# Paramètre : timeout = attente maximale en secondes (filet de sécurité si
+#             une clé a été montée juste avant l'appel)
+# ============================================================================
+def wait_for_mount(timeout):
+    """Attend un changement de la liste des montages"""
+    
+    # Le noyau signale POLLPRI sur /proc/self/mounts dès que la liste des
+    # montages change après l'ouverture du fichier : pas besoin de le lire
+    with open("/proc/self/mounts") as mounts:
+        poller = select.poll()
+        poller.register(mounts, select.POLLPRI)
+        poller.register(STOP_PIPE_R, select.POLLIN)
+        poller.poll(timeout * 1000)
+
+
+# ============================================================================
+# FONCTION : setup_logging
+# ============================================================================
+# Rôle : Configurer l'affichage des messages
+#        La boucle principale dépose seulement les messages dans une file
+#        d'attente : un thread séparé les horodate et les écrit. Un terminal
+#        ou un journal système lent ne bloque donc jamais l'enregistrement
+# ============================================================================
+def setup_logging():
+    """Affiche les messages depuis un thread séparé (QueueListener)"""
+    
+    # Chaque message ne garde que ce qui est affiché (heure + texte) : pas
+    # besoin de relever le thread ou le processus à chaque message
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    
+    # File d'attente sans limite entre le script et le thread d'affichage
+    log_queue = queue.Queue(-1)
+    
+    # Format des messages : "[2025-10-03 14:35:20] message"
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s",
+                                           datefmt="%Y-%m-%d %H:%M:%S"))
+    
+    # Thread d'affichage : lit la file et écrit chaque message
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    
+    # À la fin du script, afficher les derniers messages avant de quitter
+    atexit.register(listener.stop)
+    
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(logging.INFO)
 
 
 # ============================================================================
 # FONCTION PRINCIPALE : main
 # ============================================================================
 def main():
+    # Ce script sur son propre cœur, AVANT de créer ses threads (ils en
+    # héritent). ffmpeg aussi en hérite, mais raise_priority le déplace
+    # ensuite sur FFMPEG_CPUS
+    if SUPERVISOR_CPUS:
+        os.sched_setaffinity(0, SUPERVISOR_CPUS)
+    
+    # Les messages sont affichés par un thread séparé
+    setup_logging()
+    
+    # Arrêt propre sur systemctl stop / extinction (SIGTERM) et Ctrl+C (SIGINT)
+    signal.signal(signal.SIGTERM, graceful_stop)
+    signal.signal(signal.SIGINT, graceful_stop)
+    
+    # Écriture régulière du segment en cours sur la clé (daemon : le thread
+    # s'arrête tout seul avec le script)
+    threading.Thread(target=drip_sync, daemon=True).start()
+    
     # Message de démarrage du système
-    print("=== Dashcam Recorder démarré (mode 2 clés USB - VIDÉO SEULE) ===")
+    log.info("=== Dashcam Recorder démarré (mode 2 clés USB - VIDÉO SEULE) ===")
     
-    # Boucle infinie : tourne sans fin jusqu'à l'arrêt du système
-    while True:
+    proc = None         # Processus ffmpeg en cours (None = aucun)
+    current_usb = None  # Clé sur laquelle ffmpeg est en train d'écrire
+    next_check = 0      # Moment de la prochaine vérification des clés
+    started_at = 0      # Moment du dernier lancement de ffmpeg
+    restart_delay = RESTART_DELAY_MIN  # Attente avant la prochaine relance
+    
+    # Boucle principale : tourne jusqu'à l'arrêt demandé (voir graceful_stop)
+    while not STOP_REQUESTED:
         
         # ---------- ÉTAPE 1 : Sélectionner la clé USB à utiliser ----------
-        usb_path = select_usb_path()
-        
-        # Si aucune clé n'a été détectée
-        if not usb_path:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-                  f"ERREUR: Aucune clé USB détectée")
-            print("Nouvelle tentative dans 5 secondes...")
+        # Pendant l'enregistrement, on ne revérifie les clés que toutes les
+        # CHECK_INTERVAL secondes
+        if proc is None or time.monotonic() >= next_check:
+            usb_path = select_usb_path()
+            next_check = time.monotonic() + CHECK_INTERVAL
             
-            time.sleep(5)
+            # Si aucune clé n'a été détectée
+            if not usb_path:
+                if proc is not None:
+                    stop_recording(proc)
+                    proc = None
+                
+                log.error("ERREUR: Aucune clé USB détectée")
+                log.info("En attente d'une clé USB...")
+                
+                wait_for_mount(5)
+                
+                continue
             
-            continue
+            # ---------- ÉTAPE 2 : Basculer si la clé sélectionnée a changé ----------
+            # Pas besoin d'arrêter ffmpeg (ce qui couperait l'enregistrement) :
+            # le segment en cours se termine sur l'ancienne clé, le suivant
+            # sera créé sur la nouvelle. MIN_FREE_SPACE_GB (2 Go) laisse
+            # largement la place de finir le segment en cours
+            if proc is not None and usb_path != current_usb:
+                log.info("Bascule de %s vers %s au prochain segment",
+                         current_usb, usb_path)
+                
+                # Fichiers déjà sur la nouvelle clé, relevés AVANT de changer
+                # le lien : tout fichier apparu ensuite est un segment de ffmpeg
+                KNOWN_SEGMENTS.update(list_segments(usb_path))
+                set_current_usb(usb_path)
+                current_usb = usb_path
         
-        # ---------- ÉTAPE 2 : Enregistrer une vidéo ----------
-        record_video(usb_path)
+        # ---------- ÉTAPE 3 : (Re)lancer ffmpeg si nécessaire ----------
+        if proc is None:
+            proc = start_continuous_recording(usb_path)
+            current_usb = usb_path
+            started_at = time.monotonic()
+            
+            if proc is None:
+                wait_for_stop(5)
+                continue
+        
+        # ---------- ÉTAPE 4 : Surveiller ffmpeg ----------
+        # On attend au maximum POLL_INTERVAL secondes : si ffmpeg s'arrête
+        # avant (erreur, clé retirée...), on le relance après restart_delay
+        try:
+            proc.wait(timeout=POLL_INTERVAL)
+            
+            log.warning("ffmpeg s'est arrêté (code %s, détails dans %s)",
+                        proc.returncode, FFMPEG_LOG)
+            close_segment()
+            proc = None
+            
+            # La clé a peut-être été retirée : on oublie les mesures mémorisées
+            # pour vraiment revérifier les clés avant de relancer ffmpeg
+            FREE_SPACE_CACHE.clear()
+            
+            # ffmpeg a tourné un bon moment : arrêt isolé, on repart de
+            # l'attente la plus courte. Sinon il échoue dès son lancement :
+            # chaque nouvel échec double l'attente
+            if time.monotonic() - started_at > RESTART_DELAY_MAX:
+                restart_delay = RESTART_DELAY_MIN
+            
+            log.info("Relance de ffmpeg dans %d secondes...", restart_delay)
+            wait_for_stop(restart_delay)
+            restart_delay = min(2 * restart_delay, RESTART_DELAY_MAX)
         
-        # ---------- ÉTAPE 3 : Petite pause ----------
-        time.sleep(INTERVAL)
+        except subprocess.TimeoutExpired:
+            # ---------- ÉTAPE 5 : Suivre le segment en cours ----------
+            # ffmpeg tourne toujours : a-t-il commencé un nouveau fichier ?
+            track_segment(current_usb)
+            
+            # Journal d'erreurs borné à FFMPEG_LOG_MAX_BYTES
+            rotate_ffmpeg_log(FFMPEG_LOG_MAX_BYTES)
+                
+            # ---------- ÉTAPE 6 : Vérifier que la clé tient le coup ----------
+            # Mesure fraîche (sans le cache) : si la clé est presque pleine
+            # ou a été retirée, on arrête ffmpeg tout de suite pour que le
+            # segment en cours reste lisible
+            # Cette mesure est aussi mémorisée : tant que la clé a largement
+            # la place, select_usb_path (ÉTAPE 1) la réutilise sans rien
+            # revérifier, ni l'autre clé, ni celle-ci
+            free_space = get_free_space_gb(current_usb, max_age=0)
+                
+            if free_space is None or free_space < EMERGENCY_FREE_SPACE_GB:
+                log.error("ERREUR: %s pleine ou retirée, arrêt de ffmpeg",
+                          current_usb)
+                stop_recording(proc)
+                proc = None
+                FREE_SPACE_CACHE.clear()
+                    
+                log.info("Nouvelle tentative dans 5 secondes...")
+                wait_for_stop(5)
+            
+            # ---------- ÉTAPE 7 : Vérifier que ffmpeg avance ----------
+            # ffmpeg bloqué : on l'arrête, il sera relancé au tour suivant
+            elif segment_is_stalled(proc.pid):
+                log.error("ERREUR: rien d'écrit depuis %d secondes, "
+                          "relance de ffmpeg", STALL_TIMEOUT)
+                stop_recording(proc)
+                proc = None
+    
+    # ---------- ARRÊT DEMANDÉ ----------
+    # ffmpeg reçoit UN SEUL SIGINT (voir stop_recording) : il termine son
+    # fichier, le dernier segment reste lisible
+    log.info("Arrêt demandé")
+    
+    if proc is not None:
+        stop_recording(proc)
 
 
 # ============================================================================